@@ -87,6 +87,7 @@ class UnstructuredDtoKeys:
 
 class StructuredDtoKeys:
     BINARY_DATA = "binary_data"
+    BINARY_STREAM = "binary_stream"
     MIMETYPE = "mimetype"
     TARGET_BINARY_DATA = "target_binary_data"
     TARGET_MIMETYPE = "target_mimetype"
@@ -501,3 +502,13 @@ def verify_pyarrow_module():
     if pyarrow is None:
         raise ModuleNotFoundError("Please install pyarrow to support Arrow format")
     return pyarrow
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_orjson_module():
+    return orjson
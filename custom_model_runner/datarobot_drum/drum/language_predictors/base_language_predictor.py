@@ -137,6 +137,18 @@ class BaseLanguagePredictor(ABC):
         """ Check if read_input_data hook defined in predictor """
         pass
 
+    def accepts_binary_stream(self):
+        """ Check if predict can read input from a file-like object passed as binary_stream """
+        return False
+
+    def accepts_binary_buffer(self):
+        """
+        Check if predict/transform can read binary data passed as any bytes-like object
+        and don't use it after returning, so it can be a memoryview over a buffer
+        reused across requests
+        """
+        return False
+
     def model_info(self):
         model_info = {
             ModelInfoKeys.TARGET_TYPE: self._target_type.value,
@@ -46,6 +46,15 @@ class PythonPredictor(BaseLanguagePredictor):
     def has_read_input_data_hook(self):
         return self._model_adapter.has_read_input_data_hook()
 
+    def accepts_binary_buffer(self):
+        # read_input_data hook expects the input as bytes,
+        # DRUM readers copy the data they need out of the buffer
+        return not self.has_read_input_data_hook()
+
+    def accepts_binary_stream(self):
+        # read_input_data hook and monitoring expect the input as bytes
+        return not self.has_read_input_data_hook() and self._params["monitor"] != "True"
+
     def _predict(self, **kwargs):
         kwargs[TARGET_TYPE_ARG_KEYWORD] = self._target_type
         if self._positive_class_label is not None and self._negative_class_label is not None:
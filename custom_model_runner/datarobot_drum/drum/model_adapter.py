@@ -3,6 +3,7 @@ import os
 import pickle
 import sys
 import textwrap
+from concurrent.futures import ThreadPoolExecutor, wait
 from inspect import signature
 from pathlib import Path
 
@@ -37,6 +38,10 @@ from datarobot_drum.drum.utils import marshal_labels, StructuredInputReadUtils
 
 RUNNING_LANG_MSG = "Running environment language: Python."
 
+# Used to read target data in parallel with features data;
+# pandas csv parser and pyarrow release the GIL while reading.
+_load_data_executor = ThreadPoolExecutor(max_workers=1)
+
 
 class PythonModelAdapter:
     def __init__(self, model_dir, target_type=None):
@@ -338,6 +343,8 @@ class PythonModelAdapter:
         pd.DataFrame
         """
         input_binary_data = kwargs.get(StructuredDtoKeys.BINARY_DATA)
+        if input_binary_data is None:
+            input_binary_data = kwargs.get(StructuredDtoKeys.BINARY_STREAM)
         sparse_colnames = kwargs.get(StructuredDtoKeys.SPARSE_COLNAMES)
         data = self.load_data(
             input_binary_data,
@@ -377,17 +384,31 @@ class PythonModelAdapter:
         target_binary_data = kwargs.get(StructuredDtoKeys.TARGET_BINARY_DATA)
         sparse_colnames_bin_data = kwargs.get(StructuredDtoKeys.SPARSE_COLNAMES)
 
-        data = self.load_data(
-            input_binary_data,
-            kwargs.get(StructuredDtoKeys.MIMETYPE),
-            sparse_colnames=sparse_colnames_bin_data,
-        )
-        target_data = None
-
+        target_data_future = None
         if target_binary_data:
-            target_data = self.load_data(
-                target_binary_data, kwargs.get(StructuredDtoKeys.TARGET_MIMETYPE), try_hook=False
+            target_data_future = _load_data_executor.submit(
+                self.load_data,
+                target_binary_data,
+                kwargs.get(StructuredDtoKeys.TARGET_MIMETYPE),
+                try_hook=False,
+            )
+
+        try:
+            data = self.load_data(
+                input_binary_data,
+                kwargs.get(StructuredDtoKeys.MIMETYPE),
+                sparse_colnames=sparse_colnames_bin_data,
             )
+        except BaseException:
+            # target binary data may be a buffer reused by the next request,
+            # so target must not be still loading once transform has returned
+            if target_data_future is not None and not target_data_future.cancel():
+                wait([target_data_future])
+            raise
+        target_data = None
+
+        if target_data_future is not None:
+            target_data = target_data_future.result()
 
         if self._custom_hooks.get(CustomHooks.TRANSFORM):
             try:
@@ -256,6 +256,11 @@ class StructuredInputReadUtils:
 
     @staticmethod
     def read_structured_input_data_as_df(binary_data, mimetype, sparse_colnames=None):
+        """
+        binary_data can be either bytes-like object or a binary file-like object.
+        """
+        is_stream = hasattr(binary_data, "read")
+        data_io = binary_data if is_stream else io.BytesIO(binary_data)
         try:
             if mimetype == PredictionServerMimetypes.TEXT_MTX:
                 columns = None
@@ -264,11 +269,12 @@ class StructuredInputReadUtils:
                         column.strip().decode("utf-8")
                         for column in io.BytesIO(sparse_colnames).readlines()
                     ]
-                return pd.DataFrame.sparse.from_spmatrix(
-                    mmread(io.BytesIO(binary_data)), columns=columns
-                )
+                return pd.DataFrame.sparse.from_spmatrix(mmread(data_io), columns=columns)
             elif mimetype == PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM:
-                df = get_pyarrow_module().ipc.deserialize_pandas(binary_data)
+                if is_stream:
+                    df = get_pyarrow_module().ipc.open_stream(data_io).read_pandas()
+                else:
+                    df = get_pyarrow_module().ipc.deserialize_pandas(binary_data)
 
                 # After CSV serialization+deserialization,
                 # original dataframe's None and np.nan values
@@ -284,7 +290,7 @@ class StructuredInputReadUtils:
 
                 return df
             else:
-                return pd.read_csv(io.BytesIO(binary_data))
+                return pd.read_csv(data_io)
         except pd.errors.ParserError as e:
             raise DrumCommonException(
                 "Pandas failed to read input binary data {}".format(binary_data)
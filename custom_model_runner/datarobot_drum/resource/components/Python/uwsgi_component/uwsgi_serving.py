@@ -38,6 +38,8 @@ class UwsgiServing(RESTfulComponent, PredictMixin):
         self._run_language = None
         self._predictor = None
         self._target_type = None
+        self._is_transform = False
+        self._is_unstructured = False
         self._code_dir = None
         self._deployment_config = None
 
@@ -71,6 +73,9 @@ class UwsgiServing(RESTfulComponent, PredictMixin):
         self._show_perf = self._params.get("show_perf")
         self._run_language = RunLanguage(params.get("run_language"))
         self._target_type = TargetType(params[TARGET_TYPE_ARG_KEYWORD])
+        # precomputed, as target type is checked on every request
+        self._is_transform = self._target_type == TargetType.TRANSFORM
+        self._is_unstructured = self._target_type == TargetType.UNSTRUCTURED
 
         self._stats_collector = StatsCollector(disable_instance=not self._show_perf)
 
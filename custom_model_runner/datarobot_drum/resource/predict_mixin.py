@@ -1,5 +1,11 @@
+import io
+import re
+import threading
+
+import numpy as np
+
 from datarobot_drum.drum.exceptions import DrumSchemaValidationException
-from flask import request, Response
+from flask import request, Response, stream_with_context
 from requests_toolbelt import MultipartEncoder
 
 import werkzeug
@@ -7,18 +13,21 @@ import werkzeug
 
 from datarobot_drum.drum.common import (
     REGRESSION_PRED_COLUMN,
-    TargetType,
     UnstructuredDtoKeys,
     SPARSE_COLNAMES,
     PredictionServerMimetypes,
     X_TRANSFORM_KEY,
     Y_TRANSFORM_KEY,
+    get_orjson_module,
+    get_pyarrow_module,
 )
 from datarobot_drum.drum.utils import StructuredInputReadUtils
 from datarobot_drum.resource.transform_helpers import (
     make_arrow_payload,
+    make_arrow_combined_payload,
     is_sparse,
     make_mtx_payload,
+    make_sparse_arrow_payload,
     make_csv_payload,
 )
 from datarobot_drum.resource.deployment_config_helpers import build_pps_response_json_str
@@ -35,26 +44,153 @@ from datarobot_drum.drum.server import (
 )
 
 
+PREDICTIONS_STREAM_CHUNK_SIZE = 10000
+# Requests smaller than this are read into memory before being passed to predictor
+BINARY_STREAM_MIN_CONTENT_LENGTH = 1024 * 1024
+MULTIPART_RESPONSE_CHUNK_SIZE = 64 * 1024
+_NO_FILES = werkzeug.datastructures.ImmutableMultiDict()
+# `charset=token` parameter, matching only what werkzeug parses to the same token
+_CHARSET_PARAM_RE = re.compile(
+    r"[ \t]*charset=([\w!#$%&'*+\-.^`|~]+)[ \t]*", flags=re.ASCII | re.IGNORECASE
+)
+
+
+# dense payload format -> (function making payload from dataframe and arrow version, output format)
+_DENSE_PAYLOAD_MAKERS = {
+    "arrow": (make_arrow_payload, "arrow"),
+    # arrow stream written with the server's pyarrow version, for clients accepting arrow
+    "ipc": (
+        lambda df, arrow_version: make_arrow_payload(df, get_pyarrow_module().__version__),
+        "arrow",
+    ),
+    "csv": (lambda df, arrow_version: make_csv_payload(df), "csv"),
+}
+
+_WRONG_TARGET_TYPE_STRUCTURED_MESSAGE = "This model has target type '{}', use the {} endpoint."
+_WRONG_TARGET_TYPE_UNSTRUCTURED_MESSAGE = (
+    "This model has target type {}, use either /predict/ or /predictions/ endpoint."
+)
+_WRONG_TARGET_TYPE_TRANSFORM_MESSAGE = "This model has target type {}, use the /{}/ endpoint."
+
+
+class _ReadBufferPool(threading.local):
+    """
+    Per thread pool of buffers uploaded files are read into.
+    Buffers are reused across requests instead of being allocated for every request.
+    """
+
+    MAX_BUFFER_SIZE = 64 * 1024 * 1024
+    # X and y
+    MAX_FREE_BUFFERS = 2
+
+    def __init__(self):
+        self._free = []
+        self._acquired = []
+
+    def acquire(self, size):
+        for i, buffer in enumerate(self._free):
+            if len(buffer) >= size:
+                del self._free[i]
+                break
+        else:
+            buffer = bytearray(size)
+        self._acquired.append(buffer)
+        return buffer
+
+    def release_all(self):
+        released = [buffer for buffer in self._acquired if len(buffer) <= self.MAX_BUFFER_SIZE]
+        # keep the largest buffers sorted by size, so the smallest fitting one is acquired
+        self._free = sorted(self._free + released, key=len)[-self.MAX_FREE_BUFFERS :]
+        self._acquired = []
+
+
+_read_buffer_pool = _ReadBufferPool()
+
+
 class PredictMixin:
     """
     This class implements predict flow shared by PredictionServer and UwsgiServing classes.
     This flow assumes endpoints implemented using Flask.
+    Classes using it are expected to set `_is_transform` and `_is_unstructured`
+    flags, computed from `_target_type` once it is configured.
 
     """
 
     @staticmethod
     def _validate_content_type_header(header):
+        # Fast path for the most common headers: `mimetype` and `mimetype; charset=value`,
+        # full options header parsing is only done for anything more complex.
+        if not header:
+            return "", None
+        if ";" not in header:
+            return header.strip(" \t"), None
+        mimetype, _, params = header.partition(";")
+        mimetype = mimetype.strip(" \t")
+        charset_match = _CHARSET_PARAM_RE.fullmatch(params)
+        if mimetype and charset_match is not None:
+            return mimetype, charset_match.group(1)
+
         ret_mimetype, content_type_params_dict = werkzeug.http.parse_options_header(header)
         ret_charset = content_type_params_dict.get("charset")
         return ret_mimetype, ret_charset
 
     @staticmethod
-    def _fetch_data_from_request(file_key, logger=None):
-        filestorage = request.files.get(file_key)
+    def _read_filestorage_data(filestorage, binary_buffer=False, buffer_pool=None):
+        """
+        Read uploaded file as bytes.
+        If binary_buffer is set, file is read into a bytearray pre-sized to the file length
+        instead, so the destination buffer is allocated once and never grown.
+        If buffer_pool is provided too, file is read into a buffer acquired from the pool
+        and memoryview of the data is returned.
+        """
+        stream = filestorage.stream
+        if not binary_buffer or not hasattr(stream, "readinto"):
+            return stream.read()
+        try:
+            position = stream.tell()
+            size = stream.seek(0, io.SEEK_END) - position
+            stream.seek(position)
+        except (AttributeError, OSError, ValueError):
+            size = filestorage.content_length or request.content_length
+        if not size:
+            return stream.read()
+
+        if buffer_pool is not None:
+            binary_data = memoryview(buffer_pool.acquire(size))[:size]
+            bytes_read = stream.readinto(binary_data)
+            return binary_data[:bytes_read]
+
+        binary_data = bytearray(size)
+        bytes_read = stream.readinto(binary_data)
+        # the size can only be an upper bound when it comes from the content length
+        if bytes_read < size:
+            del binary_data[bytes_read:]
+        return binary_data
+
+    @staticmethod
+    def _request_files():
+        """
+        Return files uploaded with the request.
+        Only multipart requests carry files, so for raw body requests
+        form data parsing is skipped and body is left to be read as `request.data`.
+        """
+        if not request.mimetype.startswith("multipart/"):
+            return _NO_FILES
+        return request.files
+
+    @staticmethod
+    def _fetch_data_from_request(
+        file_key, files=None, binary_buffer=False, buffer_pool=None, logger=None
+    ):
+        if files is None:
+            files = PredictMixin._request_files()
+        filestorage = files.get(file_key)
 
         charset = None
         if filestorage is not None:
-            binary_data = filestorage.stream.read()
+            binary_data = PredictMixin._read_filestorage_data(
+                filestorage, binary_buffer, buffer_pool
+            )
             mimetype = StructuredInputReadUtils.resolve_mimetype_by_filename(filestorage.filename)
 
             if logger is not None:
@@ -78,11 +214,34 @@ class PredictMixin:
         return binary_data, mimetype, charset
 
     @staticmethod
-    def _fetch_additional_files_from_request(file_key, logger=None):
-        filestorage = request.files.get(file_key)
+    def _fetch_stream_from_request(file_key, files=None, logger=None):
+        """
+        Return uploaded file stream, so predictor can read data directly from it,
+        or None if file is not provided under file_key.
+        """
+        if files is None:
+            files = PredictMixin._request_files()
+        filestorage = files.get(file_key)
+        if filestorage is None:
+            return None
+
+        mimetype = StructuredInputReadUtils.resolve_mimetype_by_filename(filestorage.filename)
+        if logger is not None:
+            logger.debug(
+                "Filename provided under {} key: {}".format(file_key, filestorage.filename)
+            )
+        return filestorage.stream, mimetype, None
+
+    @staticmethod
+    def _fetch_additional_files_from_request(
+        file_key, files=None, binary_buffer=False, logger=None
+    ):
+        if files is None:
+            files = PredictMixin._request_files()
+        filestorage = files.get(file_key)
 
         if filestorage is not None:
-            binary_data = filestorage.stream.read()
+            binary_data = PredictMixin._read_filestorage_data(filestorage, binary_buffer)
 
             if logger is not None:
                 logger.debug(
@@ -91,6 +250,17 @@ class PredictMixin:
             return binary_data
         return None
 
+    @staticmethod
+    def _accepts_arrow_stream():
+        if get_pyarrow_module() is None:
+            return False
+        arrow_mimetype = PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM
+        # Most clients send `Accept: */*`, so arrow has to be explicitly preferred over csv.
+        best_match = request.accept_mimetypes.best_match(
+            [PredictionServerMimetypes.TEXT_CSV, arrow_mimetype]
+        )
+        return best_match == arrow_mimetype
+
     def _check_mimetype_support(self, mimetype):
         # TODO: self._predictor.supported_payload_formats is property so gets initialized on every call, make it a method?
         mimetype_supported = self._predictor.supported_payload_formats.is_mimetype_supported(
@@ -110,10 +280,27 @@ class PredictMixin:
 
     def _do_predict_structured(self, logger=None):
         response_status = HTTP_200_OK
+        files = self._request_files()
+        binary_buffer = self._predictor.accepts_binary_buffer()
         try:
-
-            binary_data, mimetype, charset = self._fetch_data_from_request("X", logger=logger)
-            sparse_data = self._fetch_additional_files_from_request(SPARSE_COLNAMES, logger=logger)
+            binary_data = None
+            binary_stream = None
+            fetched_stream = None
+            if (
+                request.content_length is not None
+                and request.content_length >= BINARY_STREAM_MIN_CONTENT_LENGTH
+                and self._predictor.accepts_binary_stream()
+            ):
+                fetched_stream = self._fetch_stream_from_request("X", files=files, logger=logger)
+            if fetched_stream is not None:
+                binary_stream, mimetype, charset = fetched_stream
+            else:
+                binary_data, mimetype, charset = self._fetch_data_from_request(
+                    "X", files=files, binary_buffer=binary_buffer, logger=logger
+                )
+            sparse_data = self._fetch_additional_files_from_request(
+                SPARSE_COLNAMES, files=files, binary_buffer=binary_buffer, logger=logger
+            )
 
             mimetype_support_error_response = self._check_mimetype_support(mimetype)
             if mimetype_support_error_response is not None:
@@ -123,31 +310,93 @@ class PredictMixin:
             return {"message": "ERROR: " + str(e)}, response_status
 
         out_data = self._predictor.predict(
-            binary_data=binary_data, mimetype=mimetype, charset=charset, sparse_colnames=sparse_data
+            binary_data=binary_data,
+            binary_stream=binary_stream,
+            mimetype=mimetype,
+            charset=charset,
+            sparse_colnames=sparse_data,
         )
 
-        if self._target_type == TargetType.UNSTRUCTURED:
+        if self._is_unstructured:
             response = out_data
 
         else:
 
-            def _build_drum_response_json_str(out_data):
+            def _float_values(column):
+                # float32 doesn't need a cast, it is serialized by orjson natively
+                if column.dtype in (np.float32, np.float64):
+                    values = column.to_numpy()
+                else:
+                    # nullable columns may contain pd.NA, which can't be cast to float
+                    values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+                return np.ascontiguousarray(values)
+
+            def _make_predictions_json_array_writer(out_data):
+                """
+                Cast predictions to float and return function serializing rows
+                from `start` to `stop` as json array.
+                Predictions are cast before the response is started, so casting errors
+                are not raised in the middle of a streamed response.
+                """
+                orjson = get_orjson_module()
+                if orjson is not None and len(out_data.columns) == 1:
+                    # orjson serializes numpy arrays natively, so there is no need to go
+                    # through pandas JSON writer. For multiple columns records would have
+                    # to be built as Python dicts, which is slower than pandas writer.
+                    values = _float_values(out_data[REGRESSION_PRED_COLUMN])
+
+                    def _write(start, stop):
+                        return orjson.dumps(values[start:stop], option=orjson.OPT_SERIALIZE_NUMPY)
+
+                    return _write
+
+                # Cast to float, which is float64, to have all the predictions
+                # serialized as floats. Frames which are already float are not copied.
+                if any(dtype.kind != "f" for dtype in out_data.dtypes):
+                    out_data = out_data.astype("float")
                 if len(out_data.columns) == 1:
                     out_data = out_data[REGRESSION_PRED_COLUMN]
-                # df.to_json() is much faster.
-                # But as it returns string, we have to assemble final json using strings.
-                df_json_str = out_data.to_json(orient="records")
-                response = '{{"predictions":{df_json}}}'.format(df_json=df_json_str)
-                return response
-
-            # float32 is not JSON serializable, so cast to float, which is float64
-            out_data = out_data.astype("float")
+
+                def _write(start, stop):
+                    # df.to_json() is much faster.
+                    # But as it returns string, we have to assemble final json using strings.
+                    return out_data.iloc[start:stop].to_json(orient="records").encode("utf-8")
+
+                return _write
+
+            def _generate_drum_response_json(write_predictions, rows_count):
+                yield b'{"predictions":['
+                for start in range(0, rows_count, PREDICTIONS_STREAM_CHUNK_SIZE):
+                    if start > 0:
+                        yield b","
+                    # strip the enclosing brackets of the chunk's json array
+                    yield write_predictions(start, start + PREDICTIONS_STREAM_CHUNK_SIZE)[1:-1]
+                yield b"]}"
+
             if self._deployment_config is not None:
+                # float32 is not JSON serializable, so cast to float, which is float64
                 response = build_pps_response_json_str(
-                    out_data, self._deployment_config, self._target_type
+                    out_data.astype("float"), self._deployment_config, self._target_type
                 )
             else:
-                response = _build_drum_response_json_str(out_data)
+                write_predictions = _make_predictions_json_array_writer(out_data)
+                if len(out_data) > PREDICTIONS_STREAM_CHUNK_SIZE:
+                    # Serialize and send large predictions chunk by chunk,
+                    # so the whole json never has to be kept in memory.
+                    # Serialization happens after the route returns, so it is not
+                    # included in the route time collected by the stats collector.
+                    response = Response(
+                        stream_with_context(
+                            _generate_drum_response_json(write_predictions, len(out_data))
+                        ),
+                        mimetype=PredictionServerMimetypes.APPLICATION_JSON,
+                    )
+                    # ask nginx not to buffer the streamed response
+                    response.headers["X-Accel-Buffering"] = "no"
+                    return response, response_status
+
+                # splice serialized array into the response json directly
+                response = b'{"predictions":' + write_predictions(0, len(out_data)) + b"}"
 
         response = Response(response, mimetype=PredictionServerMimetypes.APPLICATION_JSON)
 
@@ -156,15 +405,35 @@ class PredictMixin:
     def _transform(self, logger=None):
         response_status = HTTP_200_OK
 
+        # look up request files only once per request
+        files = self._request_files()
+
         arrow_key = "arrow_version"
-        arrow_version = request.files.get(arrow_key)
+        arrow_version = files.get(arrow_key)
         if arrow_version is not None:
-            arrow_version = eval(arrow_version.getvalue())
+            try:
+                arrow_version = float(arrow_version.getvalue())
+            except ValueError:
+                response_status = HTTP_422_UNPROCESSABLE_ENTITY
+                return (
+                    {"message": "ERROR: `{}` value must be a number".format(arrow_key)},
+                    response_status,
+                )
         use_arrow = arrow_version is not None
 
+        # Predictors that accept binary buffers don't use input after transform returns,
+        # so X and y can be read into buffers reused across requests.
+        # Buffers are released in `do_transform`.
+        binary_buffer = self._predictor.accepts_binary_buffer()
+        buffer_pool = _read_buffer_pool if binary_buffer else None
+
         try:
             feature_binary_data, feature_mimetype, feature_charset = self._fetch_data_from_request(
-                "X", logger=logger
+                "X",
+                files=files,
+                binary_buffer=binary_buffer,
+                buffer_pool=buffer_pool,
+                logger=logger,
             )
             mimetype_support_error_response = self._check_mimetype_support(feature_mimetype)
             if mimetype_support_error_response is not None:
@@ -175,22 +444,28 @@ class PredictMixin:
 
         try:
             colnames_bin_data = None
-            if SPARSE_COLNAMES in request.files.keys():
+            if SPARSE_COLNAMES in files:
                 colnames_bin_data = self._fetch_additional_files_from_request(
-                    SPARSE_COLNAMES, logger=logger
+                    SPARSE_COLNAMES, files=files, binary_buffer=binary_buffer, logger=logger
                 )
         except ValueError as e:
             response_status = HTTP_422_UNPROCESSABLE_ENTITY
             return {"message": "ERROR: " + str(e)}, response_status
 
         try:
-            if "y" in request.files.keys():
+            if "y" in files:
                 try:
                     (
                         target_binary_data,
                         target_mimetype,
                         target_charset,
-                    ) = self._fetch_data_from_request("y", logger=logger)
+                    ) = self._fetch_data_from_request(
+                        "y",
+                        files=files,
+                        binary_buffer=binary_buffer,
+                        buffer_pool=buffer_pool,
+                        logger=logger,
+                    )
                     mimetype_support_error_response = self._check_mimetype_support(target_mimetype)
                     if mimetype_support_error_response is not None:
                         return mimetype_support_error_response
@@ -219,44 +494,51 @@ class PredictMixin:
             return {"message": "ERROR: " + str(e)}, response_status
 
         # make output
-        if is_sparse(out_data):
-            if use_arrow:
-                target_payload = (
-                    make_arrow_payload(out_target, arrow_version)
-                    if out_target is not None
-                    else None
-                )
-                target_out_format = "arrow"
-            else:
-                target_payload = make_csv_payload(out_target) if out_target is not None else None
-                target_out_format = "csv"
+        accepts_arrow_stream = self._accepts_arrow_stream()
+        if (
+            use_arrow
+            and accepts_arrow_stream
+            and not is_sparse(out_data)
+            and (out_target is None or len(out_target) == len(out_data))
+        ):
+            # Client understands plain arrow stream response: write features and target
+            # into one arrow stream instead of separate payloads in a multipart response.
+            response = Response(
+                make_arrow_combined_payload(out_data, out_target, arrow_version),
+                mimetype=PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM,
+            )
+            return response, response_status
+
+        use_ipc = not use_arrow and accepts_arrow_stream
+        dense_payload_format = "arrow" if use_arrow else "ipc" if use_ipc else "csv"
+        make_dense_payload, dense_out_format = _DENSE_PAYLOAD_MAKERS[dense_payload_format]
+
+        out_is_sparse = is_sparse(out_data)
+        if out_is_sparse and use_ipc:
+            feature_payload, colnames = make_sparse_arrow_payload(out_data)
+            out_format = "sparse_arrow"
+        elif out_is_sparse:
             feature_payload, colnames = make_mtx_payload(out_data)
             out_format = "sparse"
         else:
-            if use_arrow:
-                feature_payload = make_arrow_payload(out_data, arrow_version)
-                target_payload = (
-                    make_arrow_payload(out_target, arrow_version)
-                    if out_target is not None
-                    else None
-                )
-                out_format = "arrow"
-            else:
-                feature_payload = make_csv_payload(out_data)
-                target_payload = make_csv_payload(out_target) if out_target is not None else None
-                out_format = "csv"
-            target_out_format = out_format
+            feature_payload = make_dense_payload(out_data, arrow_version)
+            out_format = dense_out_format
+        target_payload = (
+            make_dense_payload(out_target, arrow_version) if out_target is not None else None
+        )
+        target_out_format = dense_out_format
+
+        def _payload_mimetype(payload_format):
+            if use_ipc and payload_format == "arrow":
+                return PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM
+            return PredictionServerMimetypes.APPLICATION_OCTET_STREAM
 
         out_fields = {
             "X.format": out_format,
-            X_TRANSFORM_KEY: (
-                X_TRANSFORM_KEY,
-                feature_payload,
-                PredictionServerMimetypes.APPLICATION_OCTET_STREAM,
-            ),
+            X_TRANSFORM_KEY: (X_TRANSFORM_KEY, feature_payload, _payload_mimetype(out_format)),
         }
 
-        if is_sparse(out_data):
+        if out_is_sparse:
             out_fields.update(
                 {
                     SPARSE_COLNAMES: (
@@ -274,33 +556,34 @@ class PredictMixin:
                     Y_TRANSFORM_KEY: (
                         Y_TRANSFORM_KEY,
                         target_payload,
-                        PredictionServerMimetypes.APPLICATION_OCTET_STREAM,
+                        _payload_mimetype(target_out_format),
                     ),
                 }
             )
 
         m = MultipartEncoder(fields=out_fields)
 
-        response = Response(m.to_string(), mimetype=m.content_type)
+        # MultipartEncoder is a file-like object, so stream it instead of copying
+        # all the fields into one bytes object with `to_string()`
+        response = Response(
+            iter(lambda: m.read(MULTIPART_RESPONSE_CHUNK_SIZE), b""),
+            mimetype=m.content_type,
+            headers={"Content-Length": str(m.len)},
+        )
 
         return response, response_status
 
     def do_predict_structured(self, logger=None):
-        wrong_target_type_error_message = "This model has target type '{}', use the {{}} endpoint.".format(
-            self._target_type.value
-        )
-
-        return_error = False
-        if self._target_type == TargetType.TRANSFORM:
-            wrong_target_type_error_message = wrong_target_type_error_message.format("/transform/")
-            return_error = True
-        elif self._target_type == TargetType.UNSTRUCTURED:
-            wrong_target_type_error_message = wrong_target_type_error_message.format(
-                "/predictUnstructured/ or /predictionsUnstructured/"
+        endpoint = None
+        if self._is_transform:
+            endpoint = "/transform/"
+        elif self._is_unstructured:
+            endpoint = "/predictUnstructured/ or /predictionsUnstructured/"
+
+        if endpoint is not None:
+            wrong_target_type_error_message = _WRONG_TARGET_TYPE_STRUCTURED_MESSAGE.format(
+                self._target_type.value, endpoint
             )
-            return_error = True
-
-        if return_error:
             if logger is not None:
                 logger.error(wrong_target_type_error_message)
             return (
@@ -311,11 +594,10 @@ class PredictMixin:
         return self._do_predict_structured(logger=logger)
 
     def do_predict_unstructured(self, logger=None):
-        if self._target_type != TargetType.UNSTRUCTURED:
+        if not self._is_unstructured:
             response_status = HTTP_422_UNPROCESSABLE_ENTITY
-            wrong_target_type_error_message = (
-                "This model has target type {}, "
-                "use either /predict/ or /predictions/ endpoint.".format(self._target_type)
+            wrong_target_type_error_message = _WRONG_TARGET_TYPE_UNSTRUCTURED_MESSAGE.format(
+                self._target_type
             )
             if logger is not None:
                 logger.error(wrong_target_type_error_message)
@@ -354,17 +636,17 @@ class PredictMixin:
         return response, response_status
 
     def do_transform(self, logger=None):
-        if self._target_type != TargetType.TRANSFORM:
-            endpoint = (
-                "predictUnstructured" if self._target_type == TargetType.UNSTRUCTURED else "predict"
-            )
-            wrong_target_type_error_message = (
-                "This model has target type {}, "
-                "use the /{}/ endpoint.".format(self._target_type, endpoint)
+        if not self._is_transform:
+            endpoint = "predictUnstructured" if self._is_unstructured else "predict"
+            wrong_target_type_error_message = _WRONG_TARGET_TYPE_TRANSFORM_MESSAGE.format(
+                self._target_type, endpoint
             )
             if logger is not None:
                 logger.error(wrong_target_type_error_message)
             response_status = HTTP_422_UNPROCESSABLE_ENTITY
             return {"message": "ERROR: " + wrong_target_type_error_message}, response_status
 
-        return self._transform(logger=logger)
+        try:
+            return self._transform(logger=logger)
+        finally:
+            _read_buffer_pool.release_all()
@@ -1,7 +1,9 @@
+import numpy as np
 import pandas as pd
 import logging
 
 from cgi import FieldStorage
+from functools import lru_cache
 from io import BytesIO, StringIO
 
 from scipy.io import mmwrite, mmread
@@ -9,6 +11,8 @@ from scipy.sparse.csr import csr_matrix
 
 from datarobot_drum.drum.common import verify_pyarrow_module, X_FORMAT_KEY, X_TRANSFORM_KEY
 
+ARROW_X_COLUMNS_COUNT_KEY = "drum.x_columns_count"
+
 
 def filter_urllib3_logging():
     """Filter header errors from urllib3 due to a urllib3 bug."""
@@ -29,15 +33,19 @@ def is_sparse(df):
     return hasattr(df, "sparse") or type(df.iloc[0].values[0]) == csr_matrix
 
 
+@lru_cache(maxsize=1)
+def _get_legacy_ipc_write_options():
+    pa = verify_pyarrow_module()
+    return pa.ipc.IpcWriteOptions(metadata_version=pa.MetadataVersion.V4, use_legacy_format=True)
+
+
 def make_arrow_payload(df, arrow_version):
     pa = verify_pyarrow_module()
 
     if arrow_version != pa.__version__ and arrow_version < 0.2:
         batch = pa.RecordBatch.from_pandas(df, nthreads=None, preserve_index=False)
         sink = pa.BufferOutputStream()
-        options = pa.ipc.IpcWriteOptions(
-            metadata_version=pa.MetadataVersion.V4, use_legacy_format=True
-        )
+        options = _get_legacy_ipc_write_options()
         with pa.RecordBatchStreamWriter(sink, batch.schema, options=options) as writer:
             writer.write_batch(batch)
         return sink.getvalue().to_pybytes()
@@ -45,6 +53,34 @@ def make_arrow_payload(df, arrow_version):
         return pa.ipc.serialize_pandas(df, preserve_index=False).to_pybytes()
 
 
+def make_arrow_combined_payload(df, target_df, arrow_version):
+    """
+    Write transformed features and target as a single record batch of one arrow stream,
+    so schema and stream framing are written once and no multipart container is needed.
+    Features come first; number of features columns is stored in the schema metadata.
+    """
+    pa = verify_pyarrow_module()
+
+    batches = [pa.RecordBatch.from_pandas(df, preserve_index=False)]
+    if target_df is not None:
+        batches.append(pa.RecordBatch.from_pandas(target_df, preserve_index=False))
+    schema = pa.schema(
+        [field for batch in batches for field in batch.schema],
+        metadata={ARROW_X_COLUMNS_COUNT_KEY: str(batches[0].num_columns)},
+    )
+    batch = pa.RecordBatch.from_arrays(
+        [column for batch in batches for column in batch.columns], schema=schema
+    )
+
+    options = None
+    if arrow_version != pa.__version__ and arrow_version < 0.2:
+        options = _get_legacy_ipc_write_options()
+    sink = pa.BufferOutputStream()
+    with pa.RecordBatchStreamWriter(sink, schema, options=options) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue().to_pybytes()
+
+
 def make_csv_payload(df):
     s_buf = StringIO()
     df.to_csv(s_buf, index=False)
@@ -59,6 +95,28 @@ def read_arrow_payload(response_dict, transform_key):
     return df
 
 
+def read_arrow_combined_payload(payload):
+    """
+    Read payload made by `make_arrow_combined_payload`.
+    Returns tuple of features and target dataframes, target is None if it was not written.
+    """
+    pa = verify_pyarrow_module()
+
+    table = pa.ipc.open_stream(payload).read_all()
+    x_columns_count = int(table.schema.metadata[ARROW_X_COLUMNS_COUNT_KEY.encode()])
+
+    def _to_pandas(columns, names):
+        return pa.Table.from_arrays(columns, names=names).to_pandas()
+
+    df = _to_pandas(table.columns[:x_columns_count], table.column_names[:x_columns_count])
+    target_df = None
+    if table.num_columns > x_columns_count:
+        target_df = _to_pandas(
+            table.columns[x_columns_count:], table.column_names[x_columns_count:]
+        )
+    return df, target_df
+
+
 def read_csv_payload(response_dict, transform_key):
     bytes = response_dict[transform_key]
     return pd.read_csv(BytesIO(bytes))
@@ -74,12 +132,37 @@ def make_mtx_payload(df):
     return sink.getvalue(), column_payload
 
 
+def make_sparse_arrow_payload(df):
+    """
+    Write sparse dataframe as CSR matrix components: shape, data, indices and indptr,
+    each one as an arrow tensor IPC message, so buffers are dumped as is instead of
+    being formatted as MTX text.
+    """
+    pa = verify_pyarrow_module()
+
+    csr = df.sparse.to_coo().tocsr()
+    colnames = df.columns.values
+    sink = pa.BufferOutputStream()
+    for array in (np.array(csr.shape, dtype=np.int64), csr.data, csr.indices, csr.indptr):
+        pa.ipc.write_tensor(pa.Tensor.from_numpy(array), sink)
+    column_payload = "\n".join(str(colname) for colname in colnames)
+    return sink.getvalue().to_pybytes(), column_payload
+
+
 def read_mtx_payload(response_dict, transform_key):
     bytes = response_dict[transform_key]
     sparse_mat = mmread(BytesIO(bytes))
     return csr_matrix(sparse_mat)
 
 
+def read_sparse_arrow_payload(response_dict, transform_key):
+    pa = verify_pyarrow_module()
+
+    reader = pa.BufferReader(response_dict[transform_key])
+    shape, data, indices, indptr = (pa.ipc.read_tensor(reader).to_numpy() for _ in range(4))
+    return csr_matrix((data, indices, indptr), shape=tuple(shape))
+
+
 def parse_multi_part_response(response):
     parsed_response = {}
     fs = FieldStorage(
@@ -99,9 +182,13 @@ def read_x_data_from_response(response):
     def _sparse(data, key):
         return pd.DataFrame.sparse.from_spmatrix(read_mtx_payload(data, key))
 
+    def _sparse_arrow(data, key):
+        return pd.DataFrame.sparse.from_spmatrix(read_sparse_arrow_payload(data, key))
+
     reader = {
         "arrow": read_arrow_payload,
         "sparse": _sparse,
+        "sparse_arrow": _sparse_arrow,
         "csv": read_csv_payload,
     }
     data = parse_multi_part_response(response)
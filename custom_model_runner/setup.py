@@ -19,6 +19,7 @@ extras_require = {
     "keras": extra_deps[SupportedFrameworks.KERAS],
     "xgboost": extra_deps[SupportedFrameworks.XGBOOST],
     "R": ["rpy2;python_version>='3.6'"],
+    "orjson": ["orjson>=3.5"],
     "pypmml": extra_deps[SupportedFrameworks.PYPMML],
     "trainingModels": ["datarobot==2.24.0"],
 }
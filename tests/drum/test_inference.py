@@ -23,9 +23,11 @@ from datarobot_drum.drum.common import (
 )
 from datarobot_drum.drum.description import version as drum_version
 from datarobot_drum.resource.transform_helpers import (
+    read_arrow_combined_payload,
     read_arrow_payload,
     read_mtx_payload,
     read_csv_payload,
+    read_sparse_arrow_payload,
     parse_multi_part_response,
 )
 from .constants import (
@@ -374,19 +376,33 @@ class TestInference:
             assert ModelInfoKeys.MODEL_METADATA in response_dict
 
     @pytest.mark.parametrize(
-        "framework, problem, language, docker, use_arrow",
+        "framework, problem, language, docker, use_arrow, accept_arrow",
         [
-            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, True),
-            (SKLEARN_TRANSFORM, TRANSFORM, PYTHON_TRANSFORM, None, False),
-            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, False),
-            (SKLEARN_TRANSFORM, TRANSFORM, PYTHON_TRANSFORM_NO_Y, None, True),
-            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_NO_Y_DENSE, None, False),
-            (R_TRANSFORM, TRANSFORM, R_TRANSFORM, None, False),
+            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, True, False),
+            (SKLEARN_TRANSFORM, TRANSFORM, PYTHON_TRANSFORM, None, False, False),
+            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, False, False),
+            (SKLEARN_TRANSFORM, TRANSFORM, PYTHON_TRANSFORM_NO_Y, None, True, False),
+            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_NO_Y_DENSE, None, False, False),
+            (R_TRANSFORM, TRANSFORM, R_TRANSFORM, None, False, False),
+            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, False, True),
+            (R_TRANSFORM, TRANSFORM, R_TRANSFORM, None, False, True),
+            (SKLEARN_TRANSFORM_DENSE, TRANSFORM, PYTHON_TRANSFORM_DENSE, None, True, True),
+            (R_TRANSFORM, TRANSFORM, R_TRANSFORM, None, True, True),
+            (SKLEARN_TRANSFORM, TRANSFORM, PYTHON_TRANSFORM, None, False, True),
         ],
     )
     @pytest.mark.parametrize("pass_target", [True, False])
     def test_custom_transform_server(
-        self, resources, framework, problem, language, docker, tmp_path, use_arrow, pass_target,
+        self,
+        resources,
+        framework,
+        problem,
+        language,
+        docker,
+        tmp_path,
+        use_arrow,
+        accept_arrow,
+        pass_target,
     ):
         custom_model_dir = _create_custom_model_dir(
             resources, tmp_path, framework, problem, language,
@@ -409,13 +425,31 @@ class TestInference:
             if use_arrow:
                 files["arrow_version"] = ".2"
 
-            response = requests.post(run.url_server_address + "/transform/", files=files)
-            assert response.ok
+            headers = {}
+            if accept_arrow:
+                headers["Accept"] = PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM
 
-            parsed_response = parse_multi_part_response(response)
+            response = requests.post(
+                run.url_server_address + "/transform/", files=files, headers=headers
+            )
+            assert response.ok
 
-            if framework in [SKLEARN_TRANSFORM_DENSE, R_TRANSFORM]:
-                if use_arrow:
+            # without `arrow_version`, arrow format of the server's arrow version is returned
+            # if client prefers it
+            arrow_output = use_arrow or accept_arrow
+            is_dense = framework in [SKLEARN_TRANSFORM_DENSE, R_TRANSFORM]
+            if is_dense and use_arrow and accept_arrow:
+                # dense output is returned as a single arrow stream instead of multipart data
+                assert (
+                    response.headers["Content-Type"]
+                    == PredictionServerMimetypes.APPLICATION_X_APACHE_ARROW_STREAM
+                )
+                transformed_out, target_out = read_arrow_combined_payload(response.content)
+                assert (target_out is not None) == pass_target
+                actual_num_predictions = transformed_out.shape[0]
+            elif is_dense:
+                parsed_response = parse_multi_part_response(response)
+                if arrow_output:
                     transformed_out = read_arrow_payload(parsed_response, X_TRANSFORM_KEY)
                     if pass_target:
                         target_out = read_arrow_payload(parsed_response, Y_TRANSFORM_KEY)
@@ -431,12 +465,18 @@ class TestInference:
                         assert parsed_response["y.format"] == "csv"
                 actual_num_predictions = transformed_out.shape[0]
             else:
-                transformed_out = read_mtx_payload(parsed_response, X_TRANSFORM_KEY)
+                parsed_response = parse_multi_part_response(response)
+                if accept_arrow and not use_arrow:
+                    transformed_out = read_sparse_arrow_payload(parsed_response, X_TRANSFORM_KEY)
+                    assert parsed_response["X.format"] == "sparse_arrow"
+                else:
+                    transformed_out = read_mtx_payload(parsed_response, X_TRANSFORM_KEY)
+                    assert parsed_response["X.format"] == "sparse"
                 colnames = parsed_response["X.colnames"].decode("utf-8").split("\n")
                 assert len(colnames) == transformed_out.shape[1]
                 if pass_target:
                     # this shouldn't be sparse even though features are
-                    if use_arrow:
+                    if arrow_output:
                         target_out = read_arrow_payload(parsed_response, Y_TRANSFORM_KEY)
                         if pass_target:
                             assert parsed_response["y.format"] == "arrow"
@@ -445,7 +485,6 @@ class TestInference:
                         if pass_target:
                             assert parsed_response["y.format"] == "csv"
                 actual_num_predictions = transformed_out.shape[0]
-                assert parsed_response["X.format"] == "sparse"
 
             if framework == SKLEARN_TRANSFORM:
                 assert type(transformed_out) == csr_matrix
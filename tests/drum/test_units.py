@@ -1,28 +1,39 @@
+import io
 import json
 import os
 import socket
 import tempfile
+import threading
+import time
 from contextlib import closing
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 from textwrap import dedent
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import numpy as np
 import pandas as pd
 import pyarrow
 import pytest
 import responses
+import scipy.sparse
+from flask import Flask
 from pandas.testing import assert_frame_equal
+from requests_toolbelt import MultipartDecoder
 from sklearn.linear_model import LogisticRegression
 
 from datarobot_drum.drum.artifact_predictors.sklearn_predictor import SKLearnPredictor
 from datarobot_drum.drum.common import (
     MODEL_CONFIG_FILENAME,
     ModelMetadataKeys,
+    PayloadFormat,
     read_model_metadata_yaml,
+    REGRESSION_PRED_COLUMN,
+    SupportedPayloadFormats,
     TargetType,
     validate_config_fields,
+    X_FORMAT_KEY,
+    X_TRANSFORM_KEY,
 )
 from datarobot_drum.drum.drum import (
     create_custom_inference_model_folder,
@@ -38,6 +49,20 @@ from datarobot_drum.drum.language_predictors.r_predictor.r_predictor import RPre
 from datarobot_drum.drum.model_adapter import PythonModelAdapter
 from datarobot_drum.drum.push import _push_inference, _push_training, drum_push
 from datarobot_drum.drum.utils import StructuredInputReadUtils
+from datarobot_drum.resource.predict_mixin import (
+    BINARY_STREAM_MIN_CONTENT_LENGTH,
+    PredictMixin,
+    PREDICTIONS_STREAM_CHUNK_SIZE,
+)
+from datarobot_drum.resource.transform_helpers import (
+    make_arrow_combined_payload,
+    make_mtx_payload,
+    make_sparse_arrow_payload,
+    read_arrow_combined_payload,
+    read_arrow_payload,
+    read_mtx_payload,
+    read_sparse_arrow_payload,
+)
 
 
 class TestOrderIntuition:
@@ -722,3 +747,329 @@ def test_sklearn_predictor_wrong_dtype_labels(data_dtype, label_dtype):
         target_type=TargetType.BINARY,
     )
     assert all(out.columns == [str(label_dtype(0)), str(label_dtype(1))])
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, ("", None)),
+        ("text/csv", ("text/csv", None)),
+        ("text/csv; charset=utf-8", ("text/csv", "utf-8")),
+        ('text/csv; charset="utf-8"', ("text/csv", "utf-8")),
+        ("text/csv; Charset=UTF-8", ("text/csv", "UTF-8")),
+        ("text/csv; charset=utf-8; header=present", ("text/csv", "utf-8")),
+        ("text/plain; format=flowed", ("text/plain", None)),
+        ("text/csv; charset = utf-8", ("text/csv", None)),
+        ("text/csv; charset= utf-8", ("text/csv", None)),
+        (";charset=utf-8", ("", None)),
+        ("text/csv; charset=utf-8\\", ("text/csv", "utf-8")),
+        ("text/csv; charset=utf 8", ("text/csv", "utf")),
+        ("text/csv; charset=utf-8 ", ("text/csv", "utf-8")),
+    ],
+)
+def test_validate_content_type_header(header, expected):
+    assert PredictMixin._validate_content_type_header(header) == expected
+
+
+class _TestPredictor:
+    """
+    Predictor for PredictMixin tests: reads input with DRUM readers,
+    returns preset predictions and transforms input as is.
+    """
+
+    def __init__(self, predictions=None, binary_buffer=True, binary_stream=False):
+        self._predictions = predictions
+        self._binary_buffer = binary_buffer
+        self._binary_stream = binary_stream
+        self.input_data = []
+        self.input_streams = []
+        self.input_frames = []
+
+    @property
+    def supported_payload_formats(self):
+        formats = SupportedPayloadFormats()
+        formats.add(PayloadFormat.CSV)
+        formats.add(PayloadFormat.ARROW)
+        formats.add(PayloadFormat.MTX)
+        return formats
+
+    def has_read_input_data_hook(self):
+        return False
+
+    def accepts_binary_stream(self):
+        return self._binary_stream
+
+    def accepts_binary_buffer(self):
+        return self._binary_buffer
+
+    def predict(self, binary_data=None, binary_stream=None, mimetype=None, **kwargs):
+        self.input_data.append(binary_data)
+        self.input_streams.append(binary_stream)
+        df = StructuredInputReadUtils.read_structured_input_data_as_df(
+            binary_data if binary_stream is None else binary_stream, mimetype
+        )
+        self.input_frames.append(df)
+        return self._predictions
+
+    def transform(self, binary_data=None, mimetype=None, **kwargs):
+        self.input_data.append(binary_data)
+        df = StructuredInputReadUtils.read_structured_input_data_as_df(binary_data, mimetype)
+        self.input_frames.append(df)
+        return df, None
+
+
+class _TestPredictServer(PredictMixin):
+    def __init__(self, target_type, predictor):
+        self._target_type = target_type
+        self._is_transform = target_type == TargetType.TRANSFORM
+        self._is_unstructured = target_type == TargetType.UNSTRUCTURED
+        self._predictor = predictor
+        self._deployment_config = None
+
+    def test_client(self):
+        app = Flask(__name__)
+        app.testing = True
+        app.add_url_rule("/predict/", "predict", self.do_predict_structured, methods=["POST"])
+        app.add_url_rule("/transform/", "transform", self.do_transform, methods=["POST"])
+        return app.test_client()
+
+
+def test_streamed_predictions_cast_error_is_raised_before_response():
+    predictions = pd.DataFrame(
+        {REGRESSION_PRED_COLUMN: ["not a number"] + [1.0] * PREDICTIONS_STREAM_CHUNK_SIZE}
+    )
+    server = _TestPredictServer(TargetType.REGRESSION, _TestPredictor(predictions))
+
+    with pytest.raises(ValueError):
+        server.test_client().post("/predict/", data=b"a\n1\n", content_type="text/csv")
+
+
+@pytest.mark.parametrize(
+    "predictions",
+    [
+        pd.DataFrame({REGRESSION_PRED_COLUMN: np.linspace(0, 1, 7)}),
+        pd.DataFrame({REGRESSION_PRED_COLUMN: np.linspace(0, 1, 7, dtype=np.float32)}),
+        pd.DataFrame({REGRESSION_PRED_COLUMN: np.arange(7)}),
+        pd.DataFrame({REGRESSION_PRED_COLUMN: [0.5, np.nan, 1.5]}),
+        pd.DataFrame({REGRESSION_PRED_COLUMN: pd.array([True, pd.NA, False], dtype="boolean")}),
+        pd.DataFrame(
+            {
+                "yes": np.array([0.25, np.nan, 0.125], dtype=np.float32),
+                "no": [0.75, 0.5, 0.875],
+                "count": [1, 2, 3],
+            }
+        ),
+    ],
+)
+def test_predictions_json_same_with_and_without_orjson(predictions):
+    pytest.importorskip("orjson")
+
+    def _predict():
+        server = _TestPredictServer(TargetType.REGRESSION, _TestPredictor(predictions))
+        response = server.test_client().post("/predict/", data=b"a\n1\n", content_type="text/csv")
+        assert response.status_code == 200
+        return pd.DataFrame(json.loads(response.data)["predictions"])
+
+    orjson_predictions = _predict()
+    with patch("datarobot_drum.resource.predict_mixin.get_orjson_module", return_value=None):
+        pandas_predictions = _predict()
+
+    # pandas JSON writer rounds floats to 10 significant digits,
+    # while orjson writes float32 values with float32 precision
+    assert list(orjson_predictions.columns) == list(pandas_predictions.columns)
+    np.testing.assert_allclose(
+        orjson_predictions.to_numpy(dtype=float),
+        pandas_predictions.to_numpy(dtype=float),
+        rtol=1e-7,
+    )
+
+
+@pytest.mark.parametrize("binary_buffer, data_type", [(False, bytes), (True, bytearray)])
+def test_uploaded_file_is_passed_as_bytes_unless_predictor_accepts_buffer(binary_buffer, data_type):
+    predictor = _TestPredictor(
+        pd.DataFrame({REGRESSION_PRED_COLUMN: [1.0]}), binary_buffer=binary_buffer
+    )
+    server = _TestPredictServer(TargetType.REGRESSION, predictor)
+
+    response = server.test_client().post("/predict/", data={"X": (io.BytesIO(b"a\n1\n"), "X.csv")})
+
+    assert response.status_code == 200
+    assert type(predictor.input_data[0]) == data_type
+    assert predictor.input_data[0] == b"a\n1\n"
+
+
+@pytest.mark.parametrize(
+    "rows, binary_stream, passed_as_stream",
+    [
+        (10, True, False),
+        (BINARY_STREAM_MIN_CONTENT_LENGTH // 4, True, True),
+        (BINARY_STREAM_MIN_CONTENT_LENGTH // 4, False, False),
+    ],
+)
+def test_large_uploaded_file_is_passed_as_stream_to_predictor_accepting_it(
+    rows, binary_stream, passed_as_stream
+):
+    df = pd.DataFrame({"a": np.arange(rows)})
+    predictor = _TestPredictor(
+        pd.DataFrame({REGRESSION_PRED_COLUMN: np.zeros(rows)}), binary_stream=binary_stream
+    )
+    server = _TestPredictServer(TargetType.REGRESSION, predictor)
+    data = df.to_csv(index=False).encode("utf-8")
+    assert (len(data) >= BINARY_STREAM_MIN_CONTENT_LENGTH) == (rows > 10)
+
+    response = server.test_client().post("/predict/", data={"X": (io.BytesIO(data), "X.csv")})
+
+    assert response.status_code == 200
+    assert (predictor.input_streams[0] is not None) == passed_as_stream
+    assert (predictor.input_data[0] is None) == passed_as_stream
+    assert_frame_equal(predictor.input_frames[0], df)
+
+
+@pytest.mark.parametrize(
+    "has_read_input_data_hook, monitor, accepts_binary_stream",
+    [(False, "False", True), (True, "False", False), (False, "True", False)],
+)
+def test_python_predictor_accepts_binary_stream(
+    has_read_input_data_hook, monitor, accepts_binary_stream
+):
+    predictor = PythonPredictor()
+    predictor._params = {"monitor": monitor}
+    predictor._model_adapter = Mock(
+        has_read_input_data_hook=Mock(return_value=has_read_input_data_hook)
+    )
+
+    assert predictor.accepts_binary_stream() == accepts_binary_stream
+
+
+@pytest.mark.parametrize(
+    "mimetype, make_payload",
+    [
+        ("text/csv", lambda df: df.to_csv(index=False).encode("utf-8")),
+        (
+            "application/x-apache-arrow-stream",
+            lambda df: pyarrow.ipc.serialize_pandas(df, preserve_index=False).to_pybytes(),
+        ),
+        ("text/mtx", lambda df: make_mtx_payload(df)[0]),
+    ],
+)
+def test_read_structured_input_data_as_df_from_stream(mimetype, make_payload):
+    df = pd.DataFrame({"a": [1.0, 0.0, 2.5], "b": [0.0, 3.0, 0.0]})
+    if mimetype == "text/mtx":
+        df = pd.DataFrame.sparse.from_spmatrix(scipy.sparse.csr_matrix(df.to_numpy()))
+    payload = make_payload(df)
+
+    with tempfile.SpooledTemporaryFile() as stream:
+        stream.write(payload)
+        stream.seek(0)
+        stream_df = StructuredInputReadUtils.read_structured_input_data_as_df(stream, mimetype)
+    bytes_df = StructuredInputReadUtils.read_structured_input_data_as_df(payload, mimetype)
+
+    assert_frame_equal(stream_df, bytes_df)
+    values = stream_df.sparse.to_coo().toarray() if mimetype == "text/mtx" else stream_df
+    np.testing.assert_array_equal(values, [[1.0, 0.0], [0.0, 3.0], [2.5, 0.0]])
+
+
+def test_transform_reads_own_data_from_reused_buffer():
+    predictor = _TestPredictor()
+    client = _TestPredictServer(TargetType.TRANSFORM, predictor).test_client()
+    first = pd.DataFrame({"a": [1, 2, 3, 4], "b": [5, 6, 7, 8]})
+    second = pd.DataFrame({"c": [9]})
+
+    for df in [first, second]:
+        data = {"X": (io.BytesIO(df.to_csv(index=False).encode("utf-8")), "X.csv")}
+        response = client.post("/transform/", data=data)
+        assert response.status_code == 200
+
+    # second request is read into the buffer released by the first one
+    assert predictor.input_data[1].obj is predictor.input_data[0].obj
+    assert_frame_equal(predictor.input_frames[0], first)
+    assert_frame_equal(predictor.input_frames[1], second)
+
+
+def test_transform_rejects_non_numeric_arrow_version():
+    predictor = _TestPredictor()
+    client = _TestPredictServer(TargetType.TRANSFORM, predictor).test_client()
+    data = {
+        "X": (io.BytesIO(b"a\n1\n"), "X.csv"),
+        "arrow_version": (io.BytesIO(b"__import__('os')"), "arrow_version"),
+    }
+
+    response = client.post("/transform/", data=data)
+
+    assert response.status_code == 422
+    assert response.get_json() == {"message": "ERROR: `arrow_version` value must be a number"}
+    assert predictor.input_data == []
+
+
+def test_transform_reads_arrow_version():
+    df = pd.DataFrame({"a": [1, 2], "b": [0.5, 1.5]})
+    client = _TestPredictServer(TargetType.TRANSFORM, _TestPredictor()).test_client()
+    data = {
+        "X": (io.BytesIO(df.to_csv(index=False).encode("utf-8")), "X.csv"),
+        "arrow_version": (io.BytesIO(b".2"), "arrow_version"),
+    }
+
+    response = client.post("/transform/", data=data)
+
+    assert response.status_code == 200
+    parts = {
+        part.headers[b"Content-Disposition"].split(b'"')[1].decode(): part.content
+        for part in MultipartDecoder(response.data, response.content_type).parts
+    }
+    assert parts[X_FORMAT_KEY] == b"arrow"
+    assert_frame_equal(read_arrow_payload(parts, X_TRANSFORM_KEY), df)
+
+
+def test_transform_waits_for_target_loading_when_features_loading_fails():
+    adapter = PythonModelAdapter(model_dir=None, target_type=TargetType.TRANSFORM)
+    target_loading_started = threading.Event()
+    target_loaded = []
+
+    def _load_data(binary_data, mimetype, try_hook=True, sparse_colnames=None):
+        if binary_data == b"y":
+            target_loading_started.set()
+            time.sleep(0.1)
+            target_loaded.append(True)
+            return pd.DataFrame({"y": [1]})
+        target_loading_started.wait()
+        raise ValueError("features can't be loaded")
+
+    with patch.object(adapter, "load_data", side_effect=_load_data):
+        with pytest.raises(ValueError, match="features can't be loaded"):
+            adapter.transform(binary_data=b"X", target_binary_data=b"y", mimetype="text/csv")
+
+    assert target_loaded == [True]
+
+
+@pytest.mark.parametrize("arrow_version", [0.1, 2.0])
+@pytest.mark.parametrize(
+    "target_df", [None, pd.DataFrame({"target": [0.5, 1.5, np.nan]})],
+)
+def test_arrow_combined_payload_round_trip(arrow_version, target_df):
+    # features may have a column named the same as target column
+    df = pd.DataFrame({"a": [1, 2, 3], "b": ["x", "y", "z"], "target": [1.0, 2.0, 3.0]})
+
+    payload = make_arrow_combined_payload(df, target_df, arrow_version)
+    out_df, out_target_df = read_arrow_combined_payload(payload)
+
+    assert_frame_equal(out_df, df)
+    if target_df is None:
+        assert out_target_df is None
+    else:
+        assert_frame_equal(out_target_df, target_df)
+
+
+@pytest.mark.parametrize("density", [0.0, 0.2])
+def test_sparse_arrow_payload_matches_mtx_payload(density):
+    matrix = scipy.sparse.random(20, 7, density=density, format="csr", random_state=1)
+    df = pd.DataFrame.sparse.from_spmatrix(matrix, columns=["c{}".format(i) for i in range(7)])
+
+    sparse_arrow_payload, sparse_arrow_colnames = make_sparse_arrow_payload(df)
+    mtx_payload, mtx_colnames = make_mtx_payload(df)
+    sparse_arrow_matrix = read_sparse_arrow_payload({"X": sparse_arrow_payload}, "X")
+    mtx_matrix = read_mtx_payload({"X": mtx_payload}, "X")
+
+    assert sparse_arrow_colnames == mtx_colnames
+    assert sparse_arrow_matrix.shape == mtx_matrix.shape == matrix.shape
+    np.testing.assert_array_equal(sparse_arrow_matrix.toarray(), matrix.toarray())
+    np.testing.assert_allclose(sparse_arrow_matrix.toarray(), mtx_matrix.toarray())